@@ -1,15 +1,50 @@
 import streamlit as st
-import pandas as pd
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
+from datetime import datetime
+import hashlib
+from string import Template
+import textwrap
+from urllib.parse import quote
 import io
-import base64
-from PIL import Image, ImageDraw, ImageFont
-import requests
-import json
-import os
+
+# Heavy dependencies (pandas, numpy, PIL, aiosmtplib, email) are imported where
+# they are used, since Streamlit re-executes this script on every widget interaction
+
+# Cap on simultaneous SMTP connections used for batch notifications
+SMTP_MAX_CONNECTIONS = 10
+
+# Port for SMTP over implicit TLS
+SMTPS_PORT = 465
+
+# Card size in pixels
+CARD_SIZE = (400, 300)
+
+# Palette entries per card: background to text color, including anti-aliased edges
+CARD_SHADES = 16
+
+# Card templates with different colors
+CARD_TEMPLATES = {
+    "Classic": {"bg": "#FFE4E1", "text": "#8B0000"},
+    "Modern": {"bg": "#E6E6FA", "text": "#4B0082"},
+    "Fun": {"bg": "#FFB6C1", "text": "#FF1493"},
+    "Elegant": {"bg": "#F0F8FF", "text": "#191970"}
+}
+
+# Body of the birthday reminder email
+NOTIFICATION_BODY = Template("""
+    Hi there!
+    
+    This is a reminder that $name's birthday is coming up in $days day(s)!
+    
+    Birthday: $birthdate
+    Address: $address
+    
+    Would you like to send them a birthday card?
+    
+    Visit your Birthday Card Manager app to select and send a card!
+    
+    Best regards,
+    Birthday Card Manager
+    """)
 
 # Page configuration
 st.set_page_config(
@@ -20,181 +55,302 @@ st.set_page_config(
 
 # Initialize session state
 if 'contacts' not in st.session_state:
+    import pandas as pd
     st.session_state.contacts = pd.DataFrame()
+if 'contacts_hash' not in st.session_state:
+    st.session_state.contacts_hash = None
+if 'contacts_file_hash' not in st.session_state:
+    st.session_state.contacts_file_hash = None
+if 'contacts_by_name' not in st.session_state:
+    st.session_state.contacts_by_name = {}
 if 'selected_card' not in st.session_state:
     st.session_state.selected_card = None
+if 'card_png_bytes' not in st.session_state:
+    st.session_state.card_png_bytes = None
 if 'card_message' not in st.session_state:
     st.session_state.card_message = ""
 
 def load_contacts_from_file(uploaded_file):
     """Load contacts from uploaded text file"""
+    import pandas as pd
+    
     try:
-        content = uploaded_file.read().decode('utf-8')
-        lines = content.strip().split('\n')
+        contacts = pd.read_csv(
+            uploaded_file,
+            header=None,
+            usecols=lambda col: col is not None and col < 3,
+            dtype=str,
+            # Only missing fields count as NA; names like "None" or "NA" are kept
+            keep_default_na=False,
+            na_values=[''],
+            skipinitialspace=True,
+            engine='c',
+            on_bad_lines='skip'
+        )
+        contacts = contacts.apply(lambda col: col.str.strip())
+        # A file whose rows have fewer than three fields yields fewer columns
+        contacts = contacts.reindex(columns=[0, 1, 2])
+        contacts.columns = ['Name', 'Address', 'Birthdate']
+        contacts = contacts.dropna(subset=['Name', 'Address', 'Birthdate'])
         
-        contacts = []
-        for line in lines:
-            if line.strip():
-                parts = line.split(',')
-                if len(parts) >= 3:
-                    name = parts[0].strip()
-                    address = parts[1].strip()
-                    birthdate = parts[2].strip()
-                    contacts.append({
-                        'Name': name,
-                        'Address': address,
-                        'Birthdate': birthdate
-                    })
-        
-        return pd.DataFrame(contacts)
+        return contacts.reset_index(drop=True)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
     except Exception as e:
         st.error(f"Error loading file: {str(e)}")
         return pd.DataFrame()
 
-def check_upcoming_birthdays(contacts_df, days_ahead=7):
+def hash_contacts(contacts_df):
+    """Compute a content hash of the contacts DataFrame for cache keys"""
+    import pandas as pd
+    
+    return int(pd.util.hash_pandas_object(contacts_df).sum())
+
+def index_contacts_by_name(contacts_df):
+    """Map each contact name to its row for constant-time lookups"""
+    if contacts_df.empty:
+        return {}
+    
+    # First row wins for duplicate names
+    return contacts_df.drop_duplicates('Name').set_index('Name', drop=False).to_dict('index')
+
+def _birthdays_in_year(year, month, day):
+    """Return month/day arrays as datetime64[D] dates in the given year(s), NaT where invalid"""
+    import numpy as np
+    
+    month_start = year.astype('datetime64[M]') + (month - 1)
+    first_day = month_start.astype('datetime64[D]')
+    days_in_month = ((month_start + 1).astype('datetime64[D]') - first_day).astype(int)
+    
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
+    return np.where(valid, first_day + (day - 1), np.datetime64('NaT', 'D'))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def check_upcoming_birthdays(contacts_hash, _contacts_df, days_ahead=7, cache_date=None):
     """Check for upcoming birthdays"""
+    import numpy as np
+    import pandas as pd
+    
+    # cache_date only keys the cache so results refresh when the day changes; the
+    # underscore keeps Streamlit from hashing the DataFrame.
+    contacts_df = _contacts_df
     if contacts_df.empty:
         return pd.DataFrame()
     
-    today = datetime.now()
-    upcoming = []
+    now = np.datetime64(datetime.now())
+    this_year = now.astype('datetime64[Y]')
     
-    for _, contact in contacts_df.iterrows():
-        try:
-            # Parse birthdate (assuming MM/DD/YYYY or MM-DD-YYYY format)
-            birth_str = contact['Birthdate'].replace('-', '/').replace('.', '/')
-            birth_date = datetime.strptime(birth_str, '%m/%d/%Y')
-            
-            # Calculate this year's birthday
-            this_year_birthday = birth_date.replace(year=today.year)
-            
-            # If birthday has passed this year, check next year
-            if this_year_birthday < today:
-                this_year_birthday = birth_date.replace(year=today.year + 1)
-            
-            days_until = (this_year_birthday - today).days
-            
-            if 0 <= days_until <= days_ahead:
-                upcoming.append({
-                    'Name': contact['Name'],
-                    'Address': contact['Address'],
-                    'Birthdate': contact['Birthdate'],
-                    'Days Until': days_until,
-                    'This Year Birthday': this_year_birthday.strftime('%m/%d/%Y')
-                })
-        except:
-            continue
-    
-    return pd.DataFrame(upcoming)
+    # Parse birthdates (assuming MM/DD/YYYY or MM-DD-YYYY format)
+    parts = contacts_df['Birthdate'].str.replace(r'[-.]', '/', regex=True).str.extract(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+    month = pd.to_numeric(parts[0]).fillna(0).to_numpy(dtype=int, copy=True)
+    day = pd.to_numeric(parts[1]).fillna(0).to_numpy(dtype=int, copy=True)
+    birth_year = (pd.to_numeric(parts[2]).fillna(1970).to_numpy(dtype=int) - 1970).astype('datetime64[Y]')
+    
+    # Skip dates that don't exist in the birth year, such as 02/29/1991
+    month[np.isnat(_birthdays_in_year(birth_year, month, day))] = 0
+    
+    # Calculate this year's birthday; if it has passed, check next year
+    birthday = _birthdays_in_year(this_year, month, day)
+    next_birthday = _birthdays_in_year(this_year + 1, month, day)
+    birthday = np.where(birthday < now, next_birthday, birthday)
+    
+    days_until = np.floor((birthday - now) / np.timedelta64(1, 'D'))
+    mask = (days_until >= 0) & (days_until <= days_ahead)
+    
+    upcoming = contacts_df.loc[mask, ['Name', 'Address', 'Birthdate']].copy()
+    upcoming['Days Until'] = days_until[mask].astype(int)
+    upcoming['This Year Birthday'] = pd.DatetimeIndex(birthday[mask]).strftime('%m/%d/%Y')
+    
+    return upcoming.reset_index(drop=True)
+
+def build_birthday_notification(recipient_email, birthday_person, smtp_config):
+    """Build the email notification about an upcoming birthday"""
+    from email.message import EmailMessage
+    
+    body = NOTIFICATION_BODY.substitute(
+        name=birthday_person['Name'],
+        days=birthday_person['Days Until'],
+        birthdate=birthday_person['Birthdate'],
+        address=birthday_person['Address']
+    )
+    
+    msg = EmailMessage()
+    msg['From'] = smtp_config['email']
+    msg['To'] = recipient_email
+    msg['Subject'] = f"🎂 Birthday Reminder: {birthday_person['Name']}"
+    msg.set_content(body)
+    return msg
 
-def send_birthday_notification(recipient_email, birthday_person, smtp_config):
-    """Send email notification about upcoming birthday"""
+async def _send_all(messages, smtp_config, max_connections=SMTP_MAX_CONNECTIONS):
+    """Send messages concurrently over a small pool of SMTP connections"""
+    import asyncio
+    import aiosmtplib
+    
+    sent = [False] * len(messages)
+    send_errors = []
+    connect_errors = []
+    pending = iter(enumerate(messages))
+    # Port 465 expects TLS from the first byte; other ports upgrade with STARTTLS
+    use_tls = smtp_config['port'] == SMTPS_PORT
+    
+    async def connect():
+        smtp = aiosmtplib.SMTP(hostname=smtp_config['server'], port=smtp_config['port'], use_tls=use_tls, start_tls=not use_tls)
+        await smtp.connect()
+        try:
+            await smtp.login(smtp_config['email'], smtp_config['password'])
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+    
+    async def drain(smtp):
+        try:
+            # Each connection keeps pulling from the shared iterator until it is drained
+            for i, msg in pending:
+                try:
+                    await smtp.send_message(msg)
+                    sent[i] = True
+                except aiosmtplib.SMTPResponseException as e:
+                    send_errors.append(str(e))
+                except Exception as e:
+                    # The connection is gone; leave the remaining messages to the other workers
+                    send_errors.append(str(e))
+                    return
+        finally:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+    
+    async def worker():
+        try:
+            smtp = await connect()
+        except Exception as e:
+            connect_errors.append(str(e))
+            return
+        await drain(smtp)
+    
+    # Log in once before opening more connections, so bad credentials fail fast
     try:
-        msg = MIMEMultipart()
-        msg['From'] = smtp_config['email']
-        msg['To'] = recipient_email
-        msg['Subject'] = f"🎂 Birthday Reminder: {birthday_person['Name']}"
-        
-        body = f"""
-        Hi there!
-        
-        This is a reminder that {birthday_person['Name']}'s birthday is coming up in {birthday_person['Days Until']} day(s)!
-        
-        Birthday: {birthday_person['Birthdate']}
-        Address: {birthday_person['Address']}
-        
-        Would you like to send them a birthday card?
-        
-        Visit your Birthday Card Manager app to select and send a card!
-        
-        Best regards,
-        Birthday Card Manager
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP(smtp_config['server'], smtp_config['port'])
-        server.starttls()
-        server.login(smtp_config['email'], smtp_config['password'])
-        server.send_message(msg)
-        server.quit()
-        
-        return True
+        first = await connect()
     except Exception as e:
-        st.error(f"Failed to send email: {str(e)}")
-        return False
+        return sent, [str(e)]
+    
+    extra_workers = min(max_connections, len(messages)) - 1
+    await asyncio.gather(drain(first), *(worker() for _ in range(extra_workers)))
+    
+    # Extra connections refused by the server only matter if messages were left unsent
+    errors = send_errors if all(sent) else send_errors + connect_errors
+    return sent, list(dict.fromkeys(errors))
 
-def create_birthday_card(card_type, message, recipient_name):
-    """Create a birthday card image"""
-    # Create a card image (400x300 pixels)
-    width, height = 400, 300
+def send_birthday_notifications_batch(recipient_email, birthdays_df, smtp_config):
+    """Send notifications for all upcoming birthdays concurrently"""
+    import asyncio
     
-    # Card templates with different colors
-    templates = {
-        "Classic": {"bg": "#FFE4E1", "text": "#8B0000"},
-        "Modern": {"bg": "#E6E6FA", "text": "#4B0082"},
-        "Fun": {"bg": "#FFB6C1", "text": "#FF1493"},
-        "Elegant": {"bg": "#F0F8FF", "text": "#191970"}
-    }
+    # Build every message up front so the SMTP sessions only carry I/O
+    birthdays = birthdays_df.to_dict('records')
+    messages = [build_birthday_notification(recipient_email, birthday, smtp_config) for birthday in birthdays]
     
-    template = templates.get(card_type, templates["Classic"])
+    sent, errors = asyncio.run(_send_all(messages, smtp_config))
+    for error in errors:
+        st.error(f"Failed to send email: {error}")
     
-    # Create image
-    img = Image.new('RGB', (width, height), template["bg"])
-    draw = ImageDraw.Draw(img)
+    return [(birthday['Name'], ok) for birthday, ok in zip(birthdays, sent)]
+
+@st.cache_resource
+def _get_fonts():
+    """Load the card fonts once per process"""
+    from PIL import ImageFont
     
+    # Resolved once per process: Streamlit re-executes module-level code on every rerun
     try:
         # Try to use a better font if available
         title_font = ImageFont.truetype("arial.ttf", 24)
         text_font = ImageFont.truetype("arial.ttf", 16)
-    except:
+    except OSError:
         # Fallback to default font
-        title_font = ImageFont.load_default()
-        text_font = ImageFont.load_default()
+        title_font = text_font = ImageFont.load_default()
+    return title_font, text_font
+
+@st.cache_resource(max_entries=128, show_spinner=False)
+def _card_base(recipient_name):
+    """Render the title coverage, shared by every card style and message for a recipient"""
+    from PIL import Image, ImageDraw
+    
+    width, height = CARD_SIZE
+    
+    # Draw text coverage in grayscale (0 background, 255 text) so glyphs stay anti-aliased;
+    # colors are applied once the card is complete
+    img = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(img)
+    
+    title_font, _ = _get_fonts()
     
     # Draw title
     title = f"Happy Birthday, {recipient_name}!"
     title_bbox = draw.textbbox((0, 0), title, font=title_font)
     title_width = title_bbox[2] - title_bbox[0]
     title_x = (width - title_width) // 2
-    draw.text((title_x, 50), title, fill=template["text"], font=title_font)
+    draw.text((title_x, 50), title, fill=255, font=title_font)
     
-    # Draw message
-    words = message.split()
-    lines = []
-    current_line = []
+    return img
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def create_birthday_card(card_type, message, recipient_name):
+    """Create a birthday card image"""
+    from PIL import ImageColor, ImageDraw
     
-    for word in words:
-        test_line = ' '.join(current_line + [word])
-        test_bbox = draw.textbbox((0, 0), test_line, font=text_font)
-        test_width = test_bbox[2] - test_bbox[0]
-        
-        if test_width <= width - 40:
-            current_line.append(word)
-        else:
-            if current_line:
-                lines.append(' '.join(current_line))
-            current_line = [word]
+    width, height = CARD_SIZE
+    template = CARD_TEMPLATES.get(card_type, CARD_TEMPLATES["Classic"])
     
-    if current_line:
-        lines.append(' '.join(current_line))
+    # Start from the cached background and title; copy so the shared base stays clean
+    img = _card_base(recipient_name).copy()
+    draw = ImageDraw.Draw(img)
     
-    y_offset = 120
-    for line in lines:
-        line_bbox = draw.textbbox((0, 0), line, font=text_font)
-        line_width = line_bbox[2] - line_bbox[0]
-        line_x = (width - line_width) // 2
-        draw.text((line_x, y_offset), line, fill=template["text"], font=text_font)
-        y_offset += 25
+    _, text_font = _get_fonts()
     
+    # Draw message, pre-wrapped on a character budget from the message's mean glyph width
+    message = ' '.join(message.split())
+    max_width = width - 40
+    char_width = max(draw.textlength(message, font=text_font) / max(len(message), 1), 1)
+    
+    lines = []
+    for line in textwrap.wrap(message, width=max(1, int(max_width // char_width))):
+        line_width = draw.textlength(line, font=text_font)
+        if line_width > max_width:
+            # Wider-than-average glyphs overshot the budget; re-wrap on this line's own mean width
+            lines.extend(textwrap.wrap(line, width=max(1, int(len(line) * max_width // line_width))))
+        else:
+            lines.append(line)
+    text = '\n'.join(lines)
+    
+    # Keep the 25px line pitch: Pillow spaces lines by the height of "A" plus spacing
+    spacing = 25 - draw.textbbox((0, 0), 'A', font=text_font)[3]
+    text_bbox = draw.multiline_textbbox((0, 0), text, font=text_font, spacing=spacing, align='center')
+    text_x = (width - (text_bbox[2] - text_bbox[0])) // 2
+    draw.multiline_text((text_x, 120), text, fill=255, font=text_font, spacing=spacing, align='center')
+    
+    # Quantize coverage onto a palette ramp from the background to the text color
+    bg, fg = ImageColor.getrgb(template["bg"]), ImageColor.getrgb(template["text"])
+    steps = CARD_SHADES - 1
+    palette = [round(b + (f - b) * i / steps) for i in range(CARD_SHADES) for b, f in zip(bg, fg)]
+    img = img.point(lambda v: round(v * steps / 255))
+    img.putpalette(palette)
     return img
 
+@st.cache_data(max_entries=128, show_spinner=False)
+def create_birthday_card_png(card_type, message, recipient_name):
+    """Encode a birthday card image as PNG bytes"""
+    buf = io.BytesIO()
+    card_img = create_birthday_card(card_type, message, recipient_name)
+    card_img.save(buf, format='PNG', optimize=False, compress_level=1)
+    return buf.getvalue()
+
 def generate_usps_postage_link(address):
     """Generate a link to USPS postage printing"""
     # This creates a link to USPS Click-N-Ship
     base_url = "https://cns.usps.com/mailpieces"
-    encoded_address = address.replace(' ', '%20').replace(',', '%2C')
-    return f"{base_url}?destination={encoded_address}"
+    return f"{base_url}?destination={quote(address, safe='')}"
 
 def main():
     st.title("🎂 Birthday Card Manager")
@@ -243,8 +399,16 @@ def main():
         uploaded_file = st.file_uploader("Choose a text file", type=['txt'])
         
         if uploaded_file is not None:
-            contacts_df = load_contacts_from_file(uploaded_file)
-            st.session_state.contacts = contacts_df
+            # The uploader returns the same file on every rerun; only parse new uploads
+            file_bytes = uploaded_file.getvalue()
+            file_hash = hashlib.md5(file_bytes, usedforsecurity=False).hexdigest()
+            if st.session_state.contacts_file_hash != file_hash:
+                contacts_df = load_contacts_from_file(io.BytesIO(file_bytes))
+                st.session_state.contacts = contacts_df
+                st.session_state.contacts_hash = hash_contacts(contacts_df)
+                st.session_state.contacts_by_name = index_contacts_by_name(contacts_df)
+                st.session_state.contacts_file_hash = file_hash
+            contacts_df = st.session_state.contacts
             
             if not contacts_df.empty:
                 st.success(f"Loaded {len(contacts_df)} contacts!")
@@ -256,7 +420,7 @@ def main():
         st.header("Upcoming Birthdays")
         
         if not st.session_state.contacts.empty:
-            upcoming = check_upcoming_birthdays(st.session_state.contacts, days_ahead)
+            upcoming = check_upcoming_birthdays(st.session_state.contacts_hash, st.session_state.contacts, days_ahead, datetime.now().date())
             
             if not upcoming.empty:
                 st.success(f"Found {len(upcoming)} upcoming birthdays!")
@@ -264,11 +428,12 @@ def main():
                 
                 # Send notifications
                 if email_enabled and notification_email and st.button("Send Email Notifications"):
-                    for _, birthday in upcoming.iterrows():
-                        if send_birthday_notification(notification_email, birthday, smtp_config):
-                            st.success(f"Notification sent for {birthday['Name']}")
+                    results = send_birthday_notifications_batch(notification_email, upcoming, smtp_config)
+                    for name, sent in results:
+                        if sent:
+                            st.success(f"Notification sent for {name}")
                         else:
-                            st.error(f"Failed to send notification for {birthday['Name']}")
+                            st.error(f"Failed to send notification for {name}")
             else:
                 st.info(f"No birthdays in the next {days_ahead} days.")
         else:
@@ -311,10 +476,13 @@ def main():
                         # Preview card
                         st.subheader("Card Preview")
                         card_img = create_birthday_card(card_type, message, recipient)
-                        st.image(card_img, caption=f"Birthday card for {recipient}")
+                        card_png_bytes = create_birthday_card_png(card_type, message, recipient)
+                        # Show the already-encoded PNG so st.image doesn't re-encode the image each rerun
+                        st.image(card_png_bytes, caption=f"Birthday card for {recipient}")
                         
                         # Store in session state
                         st.session_state.selected_card = card_img
+                        st.session_state.card_png_bytes = card_png_bytes
                         st.session_state.card_message = message
         else:
             st.warning("Please upload contacts first.")
@@ -329,11 +497,9 @@ def main():
                 st.subheader("📱 Digital Options")
                 
                 # Download card
-                buf = io.BytesIO()
-                st.session_state.selected_card.save(buf, format='PNG')
                 btn = st.download_button(
                     label="Download Card Image",
-                    data=buf.getvalue(),
+                    data=st.session_state.card_png_bytes,
                     file_name=f"birthday_card_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png",
                     mime="image/png"
                 )
@@ -349,7 +515,7 @@ def main():
                     selected_contact = st.selectbox("Select recipient for mailing", st.session_state.contacts['Name'].tolist())
                     
                     if selected_contact:
-                        contact_info = st.session_state.contacts[st.session_state.contacts['Name'] == selected_contact].iloc[0]
+                        contact_info = st.session_state.contacts_by_name[selected_contact]
                         st.write(f"**Address:** {contact_info['Address']}")
                         
                         # USPS postage link